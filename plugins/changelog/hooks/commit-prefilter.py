@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Fast entry point for the changelog enforcement hook.
+
+Most prompts are not commit attempts, so this script only imports json and
+sys, rejects prompts that cannot match any commit pattern, and loads the full
+check-changelog-before-commit.py hook only when they might.
+"""
+
+import json
+import sys
+
+
+def might_be_commit(prompt):
+    """Cheap check mirroring the substring prefilter in is_commit_attempt."""
+    return "commit" in prompt or "COMMIT" in prompt or "Commit" in prompt
+
+
+def main():
+    """Prefilter the prompt and hand off to the full hook if needed."""
+    try:
+        input_data = json.loads(sys.stdin.buffer.read())
+
+        if not might_be_commit(input_data.get("prompt", "")):
+            # Not a commit attempt, allow it without importing the full hook
+            sys.exit(0)
+
+        # The hook's file name isn't a valid module name, so load it by path
+        import importlib.util
+        from pathlib import Path
+
+        hook_path = Path(__file__).with_name("check-changelog-before-commit.py")
+        spec = importlib.util.spec_from_file_location("check_changelog_before_commit", hook_path)
+        hook = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(hook)
+    except Exception as e:
+        # If the hook fails, don't block the user (fail open)
+        print(json.dumps({"error": str(e)}), file=sys.stderr)
+        sys.exit(0)
+
+    hook.main(input_data)
+
+
+if __name__ == "__main__":
+    main()